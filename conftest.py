@@ -0,0 +1,26 @@
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+
+
+@pytest.fixture
+def count_queries():
+    """
+    Returns a context manager that collects the SQL statements executed inside of it.
+    """
+    from models import db
+
+    @contextmanager
+    def _count_queries():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return _count_queries
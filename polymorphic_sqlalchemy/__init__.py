@@ -2,4 +2,9 @@
 from .ext import (BaseInitializer, Relation, NetRelationship, NetModel, PolyField,
                   generate_polymorphic_listener,
                   generate_polymorphic_listener_function,
-                  create_polymorphic_base)
+                  create_polymorphic_base, get_relations, get_net_relationships,
+                  CASCADE_DELETE, CASCADE_SET_NULL, CASCADE_RESTRICT)
+from .serializer import Serializer, prefetch
+from .maintenance import OrphanScanner, migrate_type
+from .cache import CollectionCache, load_collections
+from .export import PolyColumns, export_references
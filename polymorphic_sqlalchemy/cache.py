@@ -0,0 +1,169 @@
+from collections import defaultdict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session, Session
+from sqlalchemy.orm.attributes import set_committed_value
+from .ext import get_ref_relation, get_type_names, coerce_ids, SESSION_INVALIDATED_KEYS
+from .maintenance import get_primary_key
+
+
+class CollectionCache:
+    """
+    Caches the primary keys of the data objects in the generated polymorphic collections.
+
+    The cache is keyed by the relation, the ref type and the ref id. It is invalidated when
+    data objects are appended to or removed from the collection, when data objects are flushed
+    and when the cascade policy of the relation changes the data objects. The collections that
+    were invalidated in a transaction are invalidated again when it commits.
+
+    The cache is only read by load_collections. Lazy loading a collection by accessing it
+    still runs the polymorphic SELECT.
+
+    backend is any dict like object with get, __setitem__ and pop. For example a dict that is
+    shared between requests or a wrapper around an external cache. By default a dict is used.
+
+    Example:
+
+    cache = CollectionCache()
+    HasRecord = create_polymorphic_base(relations=relations, cache=cache)
+
+    load_collections(orgs, 'buyer_records')
+    """
+
+    def __init__(self, backend=None):
+        self.backend = {} if backend is None else backend
+
+    @staticmethod
+    def get_key(rel, ref_id):
+        return '{}.{}:{}:{}'.format(rel.data_class.__name__, rel.data_class_attr, rel.ref_class_name, ref_id)
+
+    def get(self, rel, ref_id):
+        return self.backend.get(self.get_key(rel, ref_id))
+
+    def set(self, rel, ref_id, keys):
+        self.backend[self.get_key(rel, ref_id)] = list(keys)
+
+    def invalidate(self, rel, ref_id):
+        self.backend.pop(self.get_key(rel, ref_id), None)
+
+
+def load_collections(ref_objs, ref_class_attr_name, session=None):
+    """
+    Loads the polymorphic collection called ref_class_attr_name of all the ref objects.
+
+    The collections that are cached are rebuilt from the identity map and the data objects
+    that are not in the identity map are loaded with one query by primary key.
+    The collections that are not cached are loaded with one query per ref class and then cached.
+    Reading the collections afterwards does not hit the database.
+
+    Example:
+
+    load_collections(orgs, 'buyer_records')
+    orgs[0].buyer_records  # No query
+    """
+    objs_by_class = defaultdict(list)
+    for ref_obj in ref_objs:
+        if ref_class_attr_name not in ref_obj.__dict__:
+            objs_by_class[ref_obj.__class__].append(ref_obj)
+
+    for ref_class, objs in objs_by_class.items():
+        rel = get_ref_relation(ref_class, ref_class_attr_name)
+        if rel.cache is None:
+            raise ValueError('The {} relation of {} is not cached'.format(ref_class_attr_name, ref_class.__name__))
+        _session = session or object_session(objs[0])
+        if _session is None:
+            raise ValueError('A session needs to be passed when the ref objects are not attached to one.')
+        misses = _load_cached(_session, rel, objs)
+        if misses:
+            _load_uncached(_session, rel, misses)
+
+
+def _load_cached(session, rel, ref_objs):
+    """
+    Sets the collections that are in the cache and returns the ref objects that are not.
+    Cached collections that contain data objects which do not point to the ref object
+    anymore are invalidated and returned too.
+    """
+    mapper = inspect(rel.data_class)
+    prefix_type = '{}_type'.format(rel.data_class_attr)
+    prefix_id = '{}_id'.format(rel.data_class_attr)
+    type_names = get_type_names(rel)
+    cached = {}
+    misses = []
+    for ref_obj in ref_objs:
+        keys = rel.cache.get(rel, ref_obj.id)
+        if keys is None:
+            misses.append(ref_obj)
+        else:
+            cached[ref_obj] = keys
+
+    data_objs = {}
+    missing_keys = set()
+    for keys in cached.values():
+        for key in keys:
+            data_obj = session.identity_map.get(mapper.identity_key_from_primary_key([key]))
+            # Expired data objects are loaded with the missing ones
+            if data_obj is None or not inspect(data_obj).unloaded.isdisjoint((prefix_type, prefix_id)):
+                missing_keys.add(key)
+            else:
+                data_objs[key] = data_obj
+
+    if missing_keys:
+        primary_key = get_primary_key(rel.data_class)
+        for data_obj in session.query(rel.data_class).filter(primary_key.in_(missing_keys)):
+            data_objs[mapper.primary_key_from_instance(data_obj)[0]] = data_obj
+
+    def belongs_to(data_obj, ref_obj):
+        if getattr(data_obj, prefix_type) not in type_names:
+            return False
+        return str(getattr(data_obj, prefix_id)) == str(ref_obj.id)
+
+    for ref_obj, keys in cached.items():
+        if all(key in data_objs and belongs_to(data_objs[key], ref_obj) for key in keys):
+            set_committed_value(ref_obj, rel.ref_class_attr_name, [data_objs[key] for key in keys])
+        else:
+            # Rows were deleted or moved to other ref objects behind the cache's back
+            rel.cache.invalidate(rel, ref_obj.id)
+            misses.append(ref_obj)
+    return misses
+
+
+def _load_uncached(session, rel, ref_objs):
+    prefix_type = getattr(rel.data_class, '{}_type'.format(rel.data_class_attr))
+    prefix_id = getattr(rel.data_class, '{}_id'.format(rel.data_class_attr))
+    primary_key = get_primary_key(rel.data_class)
+    ids = coerce_ids(prefix_id.property.columns[0], [ref_obj.id for ref_obj in ref_objs])
+
+    data_objs_by_id = defaultdict(list)
+    if ids:
+        query = (session.query(rel.data_class)
+                 .filter(prefix_type.in_(get_type_names(rel)), prefix_id.in_(ids))
+                 .order_by(primary_key))
+        for data_obj in query:
+            data_objs_by_id[str(getattr(data_obj, '{}_id'.format(rel.data_class_attr)))].append(data_obj)
+
+    mapper = inspect(rel.data_class)
+    cached_keys = session.info.setdefault(_SESSION_CACHED_KEYS, [])
+    for ref_obj in ref_objs:
+        data_objs = data_objs_by_id.get(str(ref_obj.id), [])
+        set_committed_value(ref_obj, rel.ref_class_attr_name, data_objs)
+        rel.cache.set(rel, ref_obj.id, [mapper.primary_key_from_instance(data_obj)[0] for data_obj in data_objs])
+        cached_keys.append((rel, ref_obj.id))
+
+
+# The collections that were cached in the current transaction of the session.
+# They might include uncommitted rows so they are invalidated if the transaction is rolled back.
+_SESSION_CACHED_KEYS = 'polymorphic_sqlalchemy_cached_keys'
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_keys_after_commit(session):
+    session.info.pop(_SESSION_CACHED_KEYS, None)
+    for rel, ref_id in session.info.pop(SESSION_INVALIDATED_KEYS, {}).values():
+        rel.cache.invalidate(rel, ref_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_keys_after_rollback(session):
+    session.info.pop(SESSION_INVALIDATED_KEYS, None)
+    for rel, ref_id in session.info.pop(_SESSION_CACHED_KEYS, ()):
+        rel.cache.invalidate(rel, ref_id)
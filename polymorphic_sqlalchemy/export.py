@@ -0,0 +1,237 @@
+from array import array
+from collections import Counter
+from sqlalchemy.orm import configure_mappers
+from .ext import get_relations, get_net_relationships, get_type_names
+from .misc import namedtuple_with_defaults
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FanOut = namedtuple_with_defaults('FanOut', 'rows refs max mean', default_values=(0, 0, 0, 0.0))
+
+# Type codes are stored as unsigned shorts
+MAX_TYPES = 2 ** 16
+
+
+class PolyColumns:
+    """
+    The [prefix]_type and [prefix]_id columns of a data table in columnar form.
+
+    The types are dictionary encoded: codes is an array of indexes into type_names.
+    Aliases share the code of the type name they are an alias of.
+    ids is an array of signed 64 bit integers. When numeric_ids is True they are the ids themselves.
+    Otherwise the ids are dictionary encoded too: ids holds indexes into id_values, the distinct ids
+    as they are stored, so string ids like '01' and '1' stay distinct.
+    Rows whose type or id is null are not included and are counted in nulls.
+    """
+
+    def __init__(self, prefix, type_names=(), aliases=None, numeric_ids=True):
+        self.prefix = prefix
+        self.type_names = list(type_names)
+        self.numeric_ids = numeric_ids
+        self.codes = array('H')
+        self.ids = array('q')
+        self.id_values = None if numeric_ids else []
+        self.nulls = 0
+        self._type_codes = {type_name: code for code, type_name in enumerate(self.type_names)}
+        for alias, type_name in (aliases or {}).items():
+            self._type_codes[alias] = self._type_codes[type_name]
+        self._id_codes = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _get_code(self, type_content):
+        try:
+            return self._type_codes[type_content]
+        except KeyError:
+            pass
+        if len(self.type_names) >= MAX_TYPES:
+            raise ValueError('{} can not have more than {} types'.format(self.prefix, MAX_TYPES))
+        code = self._type_codes[type_content] = len(self.type_names)
+        self.type_names.append(type_content)
+        return code
+
+    def _get_id_code(self, id_content):
+        try:
+            return self._id_codes[id_content]
+        except KeyError:
+            pass
+        code = self._id_codes[id_content] = len(self.id_values)
+        self.id_values.append(id_content)
+        return code
+
+    def extend(self, rows):
+        """
+        rows: iterable of (type, id)
+        """
+        get_code = self._get_code
+        get_id = int if self.numeric_ids else self._get_id_code
+        codes_append = self.codes.append
+        ids_append = self.ids.append
+        for type_content, id_content in rows:
+            if type_content is None or id_content is None:
+                self.nulls += 1
+                continue
+            ids_append(get_id(id_content))
+            codes_append(get_code(type_content))
+
+    def get_ids(self):
+        """
+        Returns the list of the ids as they are stored.
+        """
+        if self.numeric_ids:
+            return self.ids.tolist()
+        return [self.id_values[code] for code in self.ids]
+
+    def to_numpy(self):
+        """
+        Returns (codes, ids) as numpy arrays without copying the data.
+        When numeric_ids is False the ids are the indexes into id_values.
+        """
+        if np is None:
+            raise ImportError('numpy needs to be installed to use to_numpy')
+        codes = np.frombuffer(self.codes, dtype=np.uint16) if self.codes else np.zeros(0, dtype=np.uint16)
+        ids = np.frombuffer(self.ids, dtype=np.int64) if self.ids else np.zeros(0, dtype=np.int64)
+        return codes, ids
+
+    def count_by_type(self):
+        """
+        Returns a dict of type name to the number of rows.
+        """
+        if np is not None:
+            counts = np.bincount(self.to_numpy()[0], minlength=len(self.type_names)).tolist()
+        else:
+            counter = Counter(self.codes)
+            counts = [counter[code] for code in range(len(self.type_names))]
+        return {type_name: count for type_name, count in zip(self.type_names, counts) if count}
+
+    def _group_encoded_ids(self):
+        """
+        Returns a dict of type name to the encoded ids of that type.
+        """
+        if np is not None:
+            codes, ids = self.to_numpy()
+            order = np.argsort(codes, kind='stable')
+            sorted_codes = codes[order]
+            boundaries = np.searchsorted(sorted_codes, np.arange(len(self.type_names) + 1))
+            groups = {}
+            for code, type_name in enumerate(self.type_names):
+                start, end = boundaries[code], boundaries[code + 1]
+                if start != end:
+                    groups[type_name] = ids[order[start:end]]
+            return groups
+
+        groups = {}
+        for code, id_ in zip(self.codes, self.ids):
+            groups.setdefault(self.type_names[code], []).append(id_)
+        return groups
+
+    def group_by_type(self):
+        """
+        Returns a dict of type name to the ids of that type.
+        """
+        groups = self._group_encoded_ids()
+        if self.numeric_ids:
+            return groups
+        if np is not None:
+            id_values = np.array(self.id_values, dtype=object)
+            return {type_name: id_values[ids] for type_name, ids in groups.items()}
+        return {type_name: [self.id_values[id_] for id_ in ids] for type_name, ids in groups.items()}
+
+    def fan_out(self):
+        """
+        Returns a dict of type name to FanOut: the number of rows, the number of distinct ref ids
+        and the max and mean number of rows per ref id.
+        """
+        results = {}
+        for type_name, ids in self._group_encoded_ids().items():
+            if np is not None:
+                _, counts = np.unique(ids, return_counts=True)
+                results[type_name] = FanOut(rows=len(ids), refs=len(counts),
+                                            max=int(counts.max()), mean=float(counts.mean()))
+            else:
+                counts = Counter(ids).values()
+                results[type_name] = FanOut(rows=len(ids), refs=len(counts),
+                                            max=max(counts), mean=len(ids) / len(counts))
+        return results
+
+
+def _has_numeric_ids(data_class, prefix):
+    column = getattr(data_class, '{}_id'.format(prefix)).property.columns[0]
+    try:
+        return column.type.python_type is int
+    except NotImplementedError:
+        return False
+
+
+def _create_poly_columns(data_class, prefix):
+    type_names = []
+    aliases = {}
+    for rel in get_relations(data_class, prefix):
+        names = get_type_names(rel)
+        type_names.append(names[0])
+        aliases.update((alias, names[0]) for alias in names[1:])
+    for net in get_net_relationships(data_class, prefix):
+        type_names.append(net._class_name)
+        aliases.update((alias, net._class_name) for alias in net.aliases)
+    type_names = sorted(set(type_names))
+    return PolyColumns(prefix, type_names=type_names, aliases=aliases,
+                       numeric_ids=_has_numeric_ids(data_class, prefix))
+
+
+def export_references(session, data_class, prefixes, chunk_size=10000, criterion=None):
+    """
+    Streams the [prefix]_type and [prefix]_id columns of the data table into PolyColumns.
+
+    The rows are read from a Core result set in chunks and never turned into ORM objects.
+    All the prefixes are read in one pass over the table. The type codes of the registered
+    relations are known in advance so they are the same across exports. The ids of integer
+    [prefix]_id columns are stored as they are and the ids of other columns are dictionary encoded.
+
+    Returns a dict of prefix to PolyColumns.
+
+    Example:
+
+    columns = export_references(db.session, Records, prefixes=('buyer', 'seller'))
+    columns['buyer'].count_by_type()
+    {'org': 3, 'dealer': 2}
+    """
+    configure_mappers()
+    prefixes = tuple(prefixes)
+    results = {}
+    selected = []
+    constants = []
+    for prefix in prefixes:
+        results[prefix] = _create_poly_columns(data_class, prefix)
+        prefix_type = getattr(data_class, '{}_type'.format(prefix))
+        # The type can be a constant on the class when it never changes
+        if isinstance(prefix_type, str):
+            constants.append(prefix_type)
+            selected.append(getattr(data_class, '{}_id'.format(prefix)))
+        else:
+            constants.append(None)
+            selected.extend((prefix_type, getattr(data_class, '{}_id'.format(prefix))))
+
+    query = session.query(*selected)
+    if criterion is not None:
+        query = query.filter(criterion)
+    result = session.execute(query.statement.execution_options(stream_results=True))
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            index = 0
+            for prefix, constant in zip(prefixes, constants):
+                if constant is None:
+                    results[prefix].extend((row[index], row[index + 1]) for row in rows)
+                    index += 2
+                else:
+                    results[prefix].extend((constant, row[index]) for row in rows)
+                    index += 1
+    finally:
+        result.close()
+    return results
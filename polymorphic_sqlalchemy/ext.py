@@ -1,6 +1,9 @@
 from .misc import namedtuple_with_defaults
-from sqlalchemy import event, and_
-from sqlalchemy.orm import relationship, foreign, remote, backref
+from collections import defaultdict
+from itertools import chain
+from sqlalchemy import event, and_, inspect
+from sqlalchemy.orm import relationship, foreign, remote, backref, Session, Mapper, object_session
+from sqlalchemy.orm.attributes import InstrumentedAttribute
 from sqlalchemy.ext.associationproxy import association_proxy
 import inflection
 import logging
@@ -10,17 +13,42 @@ DELIMITER = '__'
 
 Relation = namedtuple_with_defaults(
     'Relation', 'data_class ref_class data_class_attr ref_class_attr data_class_proxy_attr ' +
-                'ref_class_name data_class_alchemy_attr ref_class_attr_name')
+                'ref_class_name data_class_alchemy_attr ref_class_attr_name cascade type_aliases cache')
+
+# What happens to the data objects when their ref object is deleted
+CASCADE_DELETE = 'delete'
+CASCADE_SET_NULL = 'set_null'
+CASCADE_RESTRICT = 'restrict'
+CASCADE_POLICIES = (CASCADE_DELETE, CASCADE_SET_NULL, CASCADE_RESTRICT)
+
+# data_class -> list of the Relations that have been resolved against their ref classes
+_registered_relations = defaultdict(list)
+
+# ref_class -> list of the Relations that have a cascade policy
+_cascade_relations = defaultdict(list)
+
+# data_class -> list of the Relations whose collections are cached
+_cached_relations = defaultdict(list)
+
+# (data_class, data_class_attr, ref_class_name) -> (Relation, ids of the ref objects deleted in the current flush)
+_SESSION_DELETED_REF_OBJECTS = 'polymorphic_sqlalchemy_deleted_ref_objects'
+
+# The cached collections that were invalidated in the current transaction of the session.
+# Other sessions can cache the old committed collections again before this transaction commits
+# so they are invalidated once more after the commit.
+SESSION_INVALIDATED_KEYS = 'polymorphic_sqlalchemy_invalidated_keys'
 
 
 def create_polymorphic_base(data_class=None, data_class_attr=None,
-                            ref_class_attr=None, data_class_proxy_attr=None, relations=None):
+                            ref_class_attr=None, data_class_proxy_attr=None, relations=None, cascade=None,
+                            type_aliases=None, cache=None):
     """
     Shortcut for generate_polymorphic_listener
     """
     if data_class:
         relation = Relation(data_class=data_class, data_class_attr=data_class_attr,
-                            ref_class_attr=ref_class_attr, data_class_proxy_attr=data_class_proxy_attr)
+                            ref_class_attr=ref_class_attr, data_class_proxy_attr=data_class_proxy_attr,
+                            cascade=cascade, type_aliases=type_aliases, cache=cache)
         relations = (relation,)
     elif relations:
         pass
@@ -57,29 +85,318 @@ def generate_polymorphic_listener(relations=None, new_format=True):
         """
 
         for relation in relations:
+            if relation.cascade is not None and relation.cascade not in CASCADE_POLICIES:
+                raise ValueError('cascade needs to be one of {}, not {}'.format(CASCADE_POLICIES, relation.cascade))
             rel_dict = relation._asdict()
             rel_dict['data_class_alchemy_attr'], rel_dict['ref_class_name'] = get_data_class_alchemy_attr(
                 ref_class=ref_class, data_class_attr=relation.data_class_attr, new_format=new_format)
             rel_dict['ref_class'] = ref_class
             rel_dict['ref_class_attr_name'] = get_ref_class_attr_name(relation)
             rel = Relation(**rel_dict)
+            _registered_relations[rel.data_class].append(rel)
+            if rel.cascade is not None:
+                _cascade_relations[rel.ref_class].append(rel)
+            if rel.cache is not None:
+                _cached_relations[rel.data_class].append(rel)
+                _add_active_history(rel)
 
             _create_orm_relation(rel)
             if rel.data_class_proxy_attr is not None:
                 _add_proxy(rel)
 
-            @event.listens_for(getattr(ref_class, rel.ref_class_attr_name), 'append')
-            def append_object(ref_obj, data_obj, initiator):
-                if new_format:
-                    prefix, _type = initiator.key.split(DELIMITER)
-                    setattr(data_obj, "{}_type".format(prefix), _type)
-                    setattr(data_obj, "{}_id".format(prefix), ref_obj.id)
-                else:
-                    setattr(data_obj, "{}_type".format(rel.data_class_attr), rel.ref_class_name)
+            _add_collection_listeners(rel, new_format)
 
     return setup_polymorphic_listener
 
 
+def _add_collection_listeners(rel, new_format):
+
+    @event.listens_for(getattr(rel.ref_class, rel.ref_class_attr_name), 'append')
+    def append_object(ref_obj, data_obj, initiator):
+        if new_format:
+            setattr(data_obj, "{}_type".format(rel.data_class_attr), rel.ref_class_name)
+            setattr(data_obj, "{}_id".format(rel.data_class_attr), ref_obj.id)
+        else:
+            setattr(data_obj, "{}_type".format(rel.data_class_attr), rel.ref_class_name)
+        if rel.cache is not None:
+            invalidate_cached_collection(object_session(ref_obj) or object_session(data_obj), rel, ref_obj.id)
+
+    if rel.cache is not None:
+        @event.listens_for(getattr(rel.ref_class, rel.ref_class_attr_name), 'remove')
+        def remove_object(ref_obj, data_obj, initiator):
+            invalidate_cached_collection(object_session(ref_obj) or object_session(data_obj), rel, ref_obj.id)
+
+
+def _add_active_history(rel):
+    """
+    The cached collections are invalidated from the history of the [prefix]_type and [prefix]_id
+    attributes. History does not load expired attributes, so the committed values are loaded
+    when they are set in order to invalidate the collection the data object is moved away from.
+    """
+    for name in ('{}_type'.format(rel.data_class_attr), '{}_id'.format(rel.data_class_attr)):
+        attr = getattr(rel.data_class, name, None)
+        # The type can be a constant on the class
+        if isinstance(attr, InstrumentedAttribute) and not attr.impl.active_history:
+            event.listen(attr, 'set', _load_old_value, active_history=True)
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    # Only needed for active_history
+    return value
+
+
+def invalidate_cached_collection(session, rel, ref_id):
+    """
+    Invalidates the cached collection and remembers it in the session so it is invalidated
+    again when the transaction commits.
+    """
+    rel.cache.invalidate(rel, ref_id)
+    if session is not None:
+        invalidated = session.info.setdefault(SESSION_INVALIDATED_KEYS, {})
+        invalidated[rel.cache.get_key(rel, ref_id)] = (rel, ref_id)
+
+
+def get_relations(data_class, data_class_attr=None):
+    """
+    Returns the Relations of data_class that have been resolved against their ref classes.
+    Relations are only registered once the ref class mappers are configured.
+    """
+    relations = _registered_relations.get(data_class, [])
+    if data_class_attr is not None:
+        relations = [rel for rel in relations if rel.data_class_attr == data_class_attr]
+    return list(relations)
+
+
+def get_ref_relation(ref_class, ref_class_attr_name):
+    """
+    Returns the Relation that generated the ref_class_attr_name collection on ref_class.
+    """
+    for relations in _registered_relations.values():
+        for rel in relations:
+            if rel.ref_class is ref_class and rel.ref_class_attr_name == ref_class_attr_name:
+                return rel
+    msg = '{} has no polymorphic collection called {}'.format(ref_class.__name__, ref_class_attr_name)
+    raise ValueError(msg)
+
+
+def get_type_names(rel):
+    """
+    Returns the type name of the ref class followed by its aliases.
+    type_aliases is a dict of the current type name to the old type names. For example when
+    ManheimRecord was renamed to SomeRecord: type_aliases={'some_record': ('manheim_record',)}
+    """
+    aliases = (rel.type_aliases or {}).get(rel.ref_class_name, ())
+    return (rel.ref_class_name,) + tuple(aliases)
+
+
+def resolve_type_alias(data_class, prefix, type_content):
+    """
+    Returns the current type name that the type_content is an alias of or None if it is not an alias.
+    """
+    for rel in get_relations(data_class, prefix):
+        if type_content in get_type_names(rel)[1:]:
+            return rel.ref_class_name
+    for net in get_net_relationships(data_class, prefix):
+        if type_content in net.aliases:
+            return net._class_name
+    return None
+
+
+def get_net_relationships(data_class, prefix=None):
+    """
+    Returns the NetRelationship descriptors defined on data_class and its superclasses.
+    NetModel descriptors are not polymorphic and are excluded.
+    """
+    net_relationships = []
+    for klass in data_class.__mro__:
+        for value in vars(klass).values():
+            if type(value) is NetRelationship and (prefix is None or value.prefix == prefix):
+                net_relationships.append(value)
+    return net_relationships
+
+
+def coerce_ids(column, ids):
+    """
+    Converts the ids to the python type of column. Ids that can not be converted are dropped
+    since they can never match a row. Returns a dict of the converted id to the list of original
+    ids since different ids such as '01' and '1' can convert to the same id.
+    """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = None
+    coerced = defaultdict(list)
+    for id_ in ids:
+        try:
+            coerced[id_ if python_type is None else python_type(id_)].append(id_)
+        except (TypeError, ValueError):
+            pass
+    return dict(coerced)
+
+
+def fetch_net_objects(_class, ids):
+    """
+    Fetches the network backed objects for the ids.
+    Uses _class.find_many(ids) when the network backed model provides it so the objects are fetched
+    in one round trip. Otherwise it falls back to calling _class.find(id) for every id.
+    find can return None or raise one of _class.not_found_exceptions (LookupError by default)
+    when the object does not exist.
+    The ids are passed to the network backed model as they are. The objects returned by find_many
+    are matched by their id as a string since the model can return 1 for the stored '1'.
+    Raises ValueError when find_many returns objects that match none of the ids.
+    Returns a dict of id to object. Ids that were not found are not in the dict.
+    """
+    ids = list(ids)
+    if hasattr(_class, 'find_many'):
+        objs_by_id = {str(obj.id): obj for obj in _class.find_many(ids) if obj is not None}
+        found = {id_: objs_by_id[str(id_)] for id_ in ids if str(id_) in objs_by_id}
+        if objs_by_id and not found:
+            msg = '{}.find_many returned objects whose ids match none of the requested ids'.format(_class.__name__)
+            raise ValueError(msg)
+        return found
+    not_found_exceptions = getattr(_class, 'not_found_exceptions', (LookupError,))
+    objs_by_id = {}
+    for id_ in ids:
+        try:
+            obj = _class.find(id_)
+        except not_found_exceptions:
+            continue
+        if obj is not None:
+            objs_by_id[id_] = obj
+    return objs_by_id
+
+
+@event.listens_for(Session, 'before_flush')
+def _forget_deleted_ref_objects(session, flush_context, instances):
+    # The ref objects of an earlier flush that failed before its cascades were applied
+    session.info.pop(_SESSION_DELETED_REF_OBJECTS, None)
+
+
+@event.listens_for(Mapper, 'after_delete')
+def _collect_deleted_ref_object(mapper, connection, target):
+    """
+    Collects the ids of all the ref objects that are deleted in a flush, including the ones
+    that the flush deletes through the cascades of other relationships.
+    """
+    relations = _cascade_relations.get(target.__class__)
+    if not relations:
+        return
+    deleted = object_session(target).info.setdefault(_SESSION_DELETED_REF_OBJECTS, {})
+    for rel in relations:
+        key = (rel.data_class, rel.data_class_attr, rel.ref_class_name)
+        # The identity does not need to refresh expired objects
+        deleted.setdefault(key, (rel, []))[1].append(inspect(target).identity[0])
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _cascade_deleted_ref_objects(session, flush_context):
+    """
+    Applies the cascade policies of the relations to the data objects of the ref objects that
+    were deleted in this flush. The ids of all the deleted ref objects are batched so there is
+    one DELETE or UPDATE per data class and ref type instead of loading every data object.
+
+    The statements run after the flush has written its own changes, so a data object that was
+    pointed at another ref object in the same flush is left alone. When a restrict policy fails,
+    ValueError is raised and the flush is rolled back.
+
+    The statements bypass the session so the data objects that are already loaded in the session
+    are synchronized afterwards without loading anything new.
+    """
+    deleted = session.info.pop(_SESSION_DELETED_REF_OBJECTS, None)
+    if not deleted:
+        return
+
+    # Restrict is checked first so nothing is changed when the flush is going to fail.
+    pending = []
+    for rel, ref_ids in deleted.values():
+        query = _get_data_objects_query(session, rel, ref_ids)
+        if query is None:
+            continue
+        if rel.cascade == CASCADE_RESTRICT:
+            if session.query(query.exists()).scalar():
+                msg = 'Can not delete {} objects that still have {}'.format(rel.ref_class.__name__,
+                                                                            rel.ref_class_attr_name)
+                raise ValueError(msg)
+        else:
+            pending.append((rel, ref_ids, query))
+
+    for rel, ref_ids, query in pending:
+        if rel.cache is not None:
+            for ref_id in ref_ids:
+                invalidate_cached_collection(session, rel, ref_id)
+        if rel.cascade == CASCADE_DELETE:
+            query.delete(synchronize_session=False)
+        else:
+            prefix_type = getattr(rel.data_class, '{}_type'.format(rel.data_class_attr))
+            prefix_id = getattr(rel.data_class, '{}_id'.format(rel.data_class_attr))
+            query.update({prefix_type: None, prefix_id: None}, synchronize_session=False)
+        _sync_loaded_data_objects(session, rel, ref_ids)
+
+
+def _sync_loaded_data_objects(session, rel, ref_ids):
+    """
+    Deleted data objects are expunged from the session and set to null data objects get their
+    [prefix]_type and [prefix]_id fields expired. Only the values that are already loaded are
+    compared so nothing is loaded from the database.
+    """
+    prefix_type = '{}_type'.format(rel.data_class_attr)
+    prefix_id = '{}_id'.format(rel.data_class_attr)
+    type_names = get_type_names(rel)
+    ref_ids = {str(ref_id) for ref_id in ref_ids}
+    for obj in list(session.identity_map.values()):
+        if not isinstance(obj, rel.data_class):
+            continue
+        state_dict = inspect(obj).dict
+        if state_dict.get(prefix_type) not in type_names or str(state_dict.get(prefix_id)) not in ref_ids:
+            continue
+        if rel.cascade == CASCADE_DELETE:
+            # An expired object would still try to UPDATE the deleted row if it was modified
+            session.expunge(obj)
+        else:
+            session.expire(obj, [prefix_type, prefix_id])
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_cached_collections(session, flush_context):
+    """
+    Invalidates the cached collections that the flushed data objects belonged to before
+    the flush and belong to after the flush.
+    """
+    if not _cached_relations:
+        return
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        relations = _cached_relations.get(obj.__class__)
+        if not relations:
+            continue
+        state = inspect(obj)
+        for rel in relations:
+            type_names = get_type_names(rel)
+            type_values = _get_history_values(state, '{}_type'.format(rel.data_class_attr))
+            if not any(type_value in type_names for type_value in type_values):
+                continue
+            for id_value in _get_history_values(state, '{}_id'.format(rel.data_class_attr)):
+                if id_value is not None:
+                    invalidate_cached_collection(session, rel, id_value)
+
+
+def _get_history_values(state, key):
+    if key not in state.attrs:
+        # For example a type that is a constant on the class
+        return (getattr(state.class_, key, None),)
+    # history does not load expired attributes unless they have active history
+    return state.attrs[key].history.sum()
+
+
+def _get_data_objects_query(session, rel, ref_ids):
+    prefix_type = getattr(rel.data_class, '{}_type'.format(rel.data_class_attr))
+    prefix_id = getattr(rel.data_class, '{}_id'.format(rel.data_class_attr))
+    ids = coerce_ids(prefix_id.property.columns[0], ref_ids)
+    if not ids:
+        return None
+    return session.query(rel.data_class).filter(prefix_type.in_(get_type_names(rel)), prefix_id.in_(ids))
+
+
 def get_ref_class_attr_name(rel):
     if rel.ref_class_attr is None:
         ref_class_attr_name = "{}s".format(get_underscored_class_name(rel.data_class))
@@ -126,10 +443,16 @@ def _create_orm_relation(rel):
 
     >>> print('{}.{} = rel'.format(rel.ref_class.__name__, rel.ref_class_attr_name))
     """
-    orm_relation = relationship(rel.data_class,
+    prefix_type = getattr(rel.data_class, "{}_type".format(rel.data_class_attr))
+    type_names = get_type_names(rel)
+    # The cascade policy is applied with bulk statements after the flush
+    # so the ORM should not load and nullify the data objects itself.
+    passive_deletes = 'all' if rel.cascade is not None else False
+    orm_relation = relationship(rel.data_class, passive_deletes=passive_deletes,
                         primaryjoin=and_(
                                         rel.ref_class.id == foreign(remote(getattr(rel.data_class, "{}_id".format(rel.data_class_attr)))),
-                                        getattr(rel.data_class, "{}_type".format(rel.data_class_attr)) == rel.ref_class_name
+                                        (prefix_type.in_(type_names) if len(type_names) > 1
+                                         else prefix_type == rel.ref_class_name)
                                     ),
                         backref=backref(
                                 rel.data_class_alchemy_attr,
@@ -143,12 +466,13 @@ def _create_orm_relation(rel):
 class NetRelationship:
     '''Descriptor for network backed object that is used in a polymorphic relationship.'''
 
-    def __init__(self, prefix, _class):
+    def __init__(self, prefix, _class, aliases=()):
         """
         Example:
 
         prefix = 'buyer'
         _class = Dealer
+        aliases = Old type names of the class that should still resolve. For example ('car_dealer',)
 
         buyer__dealer = NetRelationship(prefix='buyer', _class=Dealer)
         """
@@ -158,6 +482,7 @@ class NetRelationship:
         self._class = _class
         self._class_name = get_underscored_class_name(_class)
         self.prefixed = '_{}'.format(get_prefixed_name(prefix, self._class_name))  # Example: _buyer_dealer
+        self.aliases = tuple(aliases)
 
     def _get_and_set_obj(self, instance, prefix_id_content):
         obj = self._class.find(prefix_id_content)
@@ -179,8 +504,10 @@ class NetRelationship:
         return obj
 
     def __get__(self, instance, owner):
+        if instance is None:
+            return self
         prefix_type_content, prefix_id_content = self._get_type_field_contents(instance)
-        if prefix_type_content != self._class_name:
+        if prefix_type_content != self._class_name and prefix_type_content not in self.aliases:
             msg = '{} expected to be {}, not {}.'.format(prefix_type_content, self._class_name, prefix_type_content)
             raise ValueError(msg)
 
@@ -217,8 +544,11 @@ class NetModel(NetRelationship):
         self._class = _class
         self._class_name = get_underscored_class_name(_class)
         self.prefixed = '_{}'.format(field)
+        self.aliases = ()
 
     def __get__(self, instance, owner):
+        if instance is None:
+            return self
         prefix_id_content = getattr(instance, self.prefix_id)
         return self._get_obj_from_id(instance, prefix_id_content)
 
@@ -235,12 +565,27 @@ class PolyField:
         """
         self.prefix = prefix
         self.prefix_type = '{}_type'.format(prefix)  # buyer_type
+        self._attrs = {}  # (owner, type) -> name of the attribute that holds the object
+
+    def _get_attr(self, owner, prefix_type_content):
+        try:
+            return self._attrs[(owner, prefix_type_content)]
+        except KeyError:
+            pass
+        attr = get_prefixed_name(self.prefix, prefix_type_content)
+        if not hasattr(owner, attr):
+            _class_name = resolve_type_alias(owner, self.prefix, prefix_type_content)
+            if _class_name is None:
+                # Not cached since the relation might not be registered yet
+                return attr
+            attr = get_prefixed_name(self.prefix, _class_name)
+        self._attrs[(owner, prefix_type_content)] = attr
+        return attr
 
     def __get__(self, instance, owner):
         prefix_type_content = getattr(instance, self.prefix_type)
         if prefix_type_content is not None:
-            attr = get_prefixed_name(self.prefix, prefix_type_content)
-            return getattr(instance, attr)
+            return getattr(instance, self._get_attr(owner, prefix_type_content))
 
     def __set__(self, instance, value):
         _class_name = get_underscored_class_name(value.__class__)
@@ -0,0 +1,185 @@
+import time
+from collections import defaultdict
+from sqlalchemy import inspect
+from sqlalchemy.orm import configure_mappers
+from .ext import get_relations, get_net_relationships, get_type_names, coerce_ids, fetch_net_objects
+from .misc import namedtuple_with_defaults
+
+Orphan = namedtuple_with_defaults('Orphan', 'key type id')
+ScanResult = namedtuple_with_defaults('ScanResult', 'last_key scanned orphans unknown deleted',
+                                      default_values=(None, 0, (), (), 0))
+MigrationResult = namedtuple_with_defaults('MigrationResult', 'last_key updated', default_values=(None, 0))
+
+
+def get_primary_key(data_class):
+    primary_key = inspect(data_class).primary_key
+    if len(primary_key) != 1:
+        raise ValueError('{} needs to have a single column primary key'.format(data_class.__name__))
+    return primary_key[0]
+
+
+def iter_chunks(session, data_class, columns, chunk_size=1000, start_after=None, criterion=None):
+    """
+    Walks the data table in primary key order and yields lists of rows of (primary key, *columns).
+    Every chunk is its own query that starts after the last key of the previous chunk so
+    only one chunk is in memory and the walk can be resumed from any key.
+    """
+    primary_key = get_primary_key(data_class)
+    last_key = start_after
+    while True:
+        query = session.query(primary_key, *columns)
+        if criterion is not None:
+            query = query.filter(criterion)
+        if last_key is not None:
+            query = query.filter(primary_key > last_key)
+        rows = query.order_by(primary_key).limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        last_key = rows[-1][0]
+
+
+class OrphanScanner:
+    """
+    Finds the rows of the data table whose [prefix]_type and [prefix]_id point to objects that do not exist.
+
+    The table is scanned in chunks. The references in every chunk are grouped by class and checked
+    with one IN query per SQLAlchemy ref class and one find_many call per network backed class,
+    so a type alias and the current type name of a class share the query.
+
+    Types that have no registered relation are reported separately in unknown. Relations are
+    only registered once the ref class mappers are configured, so a type is also unknown when
+    the module of its ref class was not imported. They are only deleted with delete_unknown=True.
+
+    Example:
+
+    scanner = OrphanScanner(db.session, data_class=Records, prefix='buyer', chunk_size=1000)
+    for result in scanner.scan(start_after=checkpoint):
+        db.session.commit()
+        checkpoint = result.last_key  # Store it somewhere to resume the scan later
+    """
+
+    def __init__(self, session, data_class, prefix, chunk_size=1000):
+        self.session = session
+        self.data_class = data_class
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.prefix_type = getattr(data_class, '{}_type'.format(prefix))
+        self.prefix_id = getattr(data_class, '{}_id'.format(prefix))
+        self._ref_classes = None
+        self._net_classes = None
+
+    def _load_relations(self):
+        if self._ref_classes is None:
+            configure_mappers()
+            self._ref_classes = {type_name: rel.ref_class
+                                 for rel in get_relations(self.data_class, self.prefix)
+                                 for type_name in get_type_names(rel)}
+            self._net_classes = {type_name: net._class
+                                 for net in get_net_relationships(self.data_class, self.prefix)
+                                 for type_name in (net._class_name,) + net.aliases}
+
+    def _get_class(self, type_content):
+        return self._ref_classes.get(type_content) or self._net_classes.get(type_content)
+
+    def _existing_ids(self, _class, ids):
+        """
+        Returns the set of the ids that exist.
+        """
+        if _class in self._ref_classes.values():
+            coerced = coerce_ids(_class.id.property.columns[0], ids)
+            if not coerced:
+                return set()
+            query = self.session.query(_class.id).filter(_class.id.in_(coerced))
+            return {id_ for row in query for id_ in coerced[row[0]]}
+        return set(fetch_net_objects(_class, ids))
+
+    def find_orphans(self, rows):
+        """
+        rows: list of (key, type, id)
+        Returns (orphans, unknown) where unknown are the rows whose type has no registered relation.
+        """
+        self._load_relations()
+        keys_by_type = defaultdict(lambda: defaultdict(list))
+        for key, type_content, id_content in rows:
+            if type_content is None or id_content is None:
+                continue
+            keys_by_type[type_content][id_content].append(key)
+
+        unknown = []
+        ids_by_class = defaultdict(set)
+        for type_content, keys_by_id in list(keys_by_type.items()):
+            _class = self._get_class(type_content)
+            if _class is None:
+                unknown.extend(Orphan(key=key, type=type_content, id=id_)
+                               for id_, keys in keys_by_id.items() for key in keys)
+                del keys_by_type[type_content]
+            else:
+                ids_by_class[_class].update(keys_by_id)
+        existing = {_class: self._existing_ids(_class, ids) for _class, ids in ids_by_class.items()}
+
+        orphans = []
+        for type_content, keys_by_id in keys_by_type.items():
+            _class = self._get_class(type_content)
+            for id_, keys in keys_by_id.items():
+                if id_ not in existing[_class]:
+                    orphans.extend(Orphan(key=key, type=type_content, id=id_) for key in keys)
+        orphans.sort(key=lambda orphan: orphan.key)
+        unknown.sort(key=lambda orphan: orphan.key)
+        return orphans, unknown
+
+    def delete_orphans(self, orphans):
+        if not orphans:
+            return 0
+        primary_key = get_primary_key(self.data_class)
+        query = self.session.query(self.data_class).filter(primary_key.in_([orphan.key for orphan in orphans]))
+        return query.delete(synchronize_session=False)
+
+    def scan(self, start_after=None, delete=False, delete_unknown=False):
+        """
+        Yields a ScanResult for every chunk. The last_key of the result is the checkpoint to pass as
+        start_after in order to resume the scan. When delete is True, the orphans of every chunk are
+        deleted before the result is yielded. The rows with unknown types are only deleted when
+        delete_unknown is True too. The transaction is left to the caller to commit.
+        """
+        columns = (self.prefix_type, self.prefix_id)
+        for rows in iter_chunks(self.session, self.data_class, columns,
+                                chunk_size=self.chunk_size, start_after=start_after):
+            orphans, unknown = self.find_orphans(rows)
+            deleted = 0
+            if delete:
+                deleted = self.delete_orphans(orphans + unknown if delete_unknown else orphans)
+            yield ScanResult(last_key=rows[-1][0], scanned=len(rows), orphans=orphans, unknown=unknown,
+                             deleted=deleted)
+
+
+def migrate_type(session, data_class, prefix, old_type, new_type, batch_size=1000,
+                 start_after=None, sleep=0, commit=True):
+    """
+    Rewrites the [prefix]_type fields from old_type to new_type in small batches.
+
+    Use it after renaming a ref class. Add the old type name as an alias first so the rows
+    keep resolving while the migration is running. Every batch is one UPDATE by primary key
+    that is committed right away so the table is never locked for long. Sleep is the number of
+    seconds to wait between batches in order to throttle the migration.
+
+    Yields a MigrationResult for every batch. The last_key is the checkpoint to pass as
+    start_after in order to resume the migration.
+
+    Example:
+
+    for result in migrate_type(db.session, VehicleReferencePrice, 'source', 'manheim_record', 'some_record'):
+        checkpoint = result.last_key
+    """
+    primary_key = get_primary_key(data_class)
+    prefix_type = getattr(data_class, '{}_type'.format(prefix))
+    for rows in iter_chunks(session, data_class, (), chunk_size=batch_size,
+                            start_after=start_after, criterion=prefix_type == old_type):
+        keys = [row[0] for row in rows]
+        query = session.query(data_class).filter(primary_key.in_(keys), prefix_type == old_type)
+        updated = query.update({prefix_type: new_type}, synchronize_session=False)
+        if commit:
+            session.commit()
+        yield MigrationResult(last_key=keys[-1], updated=updated)
+        if sleep:
+            time.sleep(sleep)
@@ -0,0 +1,217 @@
+import datetime
+import decimal
+import uuid
+from collections import defaultdict
+from operator import attrgetter
+from sqlalchemy import inspect
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from .ext import (get_relations, get_net_relationships, get_prefixed_name, get_type_names,
+                  resolve_type_alias, coerce_ids, fetch_net_objects)
+
+
+def prefetch(objs, prefixes, session=None):
+    """
+    Resolves the polymorphic objects of all the data objects for the given prefixes in batches.
+
+    Every SQLAlchemy ref class is loaded with one IN query and every network backed class
+    is fetched with one find_many call (or find per id if find_many is not defined).
+    The results are set on the data objects so reading the PolyField afterwards does not
+    hit the database or the network.
+
+    Example:
+
+    prefetch(records, prefixes=('buyer', 'seller'))
+    records[0].buyer  # No query
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+
+    for prefix in prefixes:
+        # (data_class, type) -> id -> list of data objects
+        pending = defaultdict(lambda: defaultdict(list))
+        prefix_type = '{}_type'.format(prefix)
+        prefix_id = '{}_id'.format(prefix)
+        for obj in objs:
+            type_content = getattr(obj, prefix_type)
+            id_content = getattr(obj, prefix_id)
+            if type_content is None or id_content is None:
+                continue
+            pending[(obj.__class__, type_content)][id_content].append(obj)
+
+        for (data_class, type_content), objs_by_id in pending.items():
+            _resolve(data_class, prefix, type_content, objs_by_id, session)
+
+    return objs
+
+
+def _resolve(data_class, prefix, type_content, objs_by_id, session):
+    attr = get_prefixed_name(prefix, type_content)
+
+    for rel in get_relations(data_class, prefix):
+        if type_content in get_type_names(rel):
+            _resolve_sql(rel, objs_by_id, session)
+            return
+
+    for net in get_net_relationships(data_class, prefix):
+        if type_content == net._class_name or type_content in net.aliases:
+            _resolve_net(net, objs_by_id)
+            return
+
+    raise ValueError('{} has no polymorphic relation called {}'.format(data_class.__name__, attr))
+
+
+def _resolve_sql(rel, objs_by_id, session):
+    attr = rel.data_class_alchemy_attr
+    missing = {}
+    for id_, objs in objs_by_id.items():
+        objs = [obj for obj in objs if attr not in obj.__dict__]
+        if objs:
+            missing[id_] = objs
+    if not missing:
+        return
+
+    if session is None:
+        session = _find_session(missing)
+    ids = coerce_ids(rel.ref_class.id.property.columns[0], missing)
+    ref_objs = {}
+    if ids:
+        for ref_obj in session.query(rel.ref_class).filter(rel.ref_class.id.in_(ids)):
+            for id_ in ids[ref_obj.id]:
+                ref_objs[id_] = ref_obj
+
+    for id_, objs in missing.items():
+        ref_obj = ref_objs.get(id_)
+        for obj in objs:
+            set_committed_value(obj, attr, ref_obj)
+
+
+def _resolve_net(net, objs_by_id):
+    missing = {}
+    for id_, objs in objs_by_id.items():
+        # The same check as NetRelationship so the cached objects are not fetched again
+        objs = [obj for obj in objs if getattr(getattr(obj, net.prefixed, None), 'id', None) != id_]
+        if objs:
+            missing[id_] = objs
+    if not missing:
+        return
+
+    ref_objs = fetch_net_objects(net._class, missing)
+    for id_, ref_obj in ref_objs.items():
+        for obj in missing[id_]:
+            setattr(obj, net.prefixed, ref_obj)
+
+
+def _find_session(objs_by_id):
+    for objs in objs_by_id.values():
+        for obj in objs:
+            session = object_session(obj)
+            if session is not None:
+                return session
+    raise ValueError('A session needs to be passed when the data objects are not attached to one.')
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+class Serializer:
+    """
+    Serializes lists of data objects together with their polymorphic objects.
+
+    The polymorphic objects are resolved in batches via prefetch and then every object is
+    turned into a dict in one pass. The fields of every class are looked up once and cached.
+
+    Example:
+
+    serializer = Serializer(prefixes=('buyer', 'seller'))
+    serializer.serialize(records)
+    [{'id': 1, 'buyer_id': '1', 'buyer_type': 'org', 'buyer': {'id': 1}, ...}, ...]
+    """
+
+    def __init__(self, prefixes=(), fields=None, json_ready=False):
+        """
+        prefixes: The polymorphic prefixes to include. For example ('buyer', 'seller')
+        fields: Optional dict of class to the field names to serialize for that class.
+                By default all the columns of SQLAlchemy models are used. Network backed objects use
+                their to_dict() method if they have one or otherwise their public attributes.
+        json_ready: Convert dates, decimals and uuids to strings
+        """
+        self.prefixes = tuple(prefixes)
+        self.fields = fields or {}
+        self.json_ready = json_ready
+        self._accessors = {}
+        self._ref_getters = {}
+
+    def _get_accessor(self, _class):
+        try:
+            return self._accessors[_class]
+        except KeyError:
+            pass
+
+        names = self.fields.get(_class)
+        if names is None:
+            mapper = inspect(_class, raiseerr=False)
+            if mapper is not None:
+                names = [column_attr.key for column_attr in mapper.column_attrs]
+
+        if names is None:
+            if hasattr(_class, 'to_dict'):
+                accessor = _class.to_dict
+            else:
+                def accessor(obj):
+                    return {key: value for key, value in vars(obj).items() if not key.startswith('_')}
+        else:
+            names = tuple(names)
+            getter = attrgetter(*names)
+            if len(names) == 1:
+                def accessor(obj):
+                    return {names[0]: getter(obj)}
+            else:
+                def accessor(obj):
+                    return dict(zip(names, getter(obj)))
+
+        if self.json_ready:
+            raw_accessor = accessor
+
+            def accessor(obj):
+                return {key: _json_value(value) for key, value in raw_accessor(obj).items()}
+
+        self._accessors[_class] = accessor
+        return accessor
+
+    def _get_ref_getter(self, _class, prefix, type_content):
+        key = (_class, prefix, type_content)
+        try:
+            return self._ref_getters[key]
+        except KeyError:
+            pass
+        _class_name = resolve_type_alias(_class, prefix, type_content) or type_content
+        getter = self._ref_getters[key] = attrgetter(get_prefixed_name(prefix, _class_name))
+        return getter
+
+    def _serialize_obj(self, obj):
+        if obj is None:
+            return None
+        return self._get_accessor(obj.__class__)(obj)
+
+    def serialize(self, objs, session=None):
+        objs = prefetch(objs, self.prefixes, session=session)
+        prefix_types = [(prefix, '{}_type'.format(prefix)) for prefix in self.prefixes]
+        results = []
+        for obj in objs:
+            result = self._serialize_obj(obj)
+            for prefix, prefix_type in prefix_types:
+                type_content = getattr(obj, prefix_type)
+                if type_content is None:
+                    result[prefix] = None
+                else:
+                    ref_obj = self._get_ref_getter(obj.__class__, prefix, type_content)(obj)
+                    result[prefix] = self._serialize_obj(ref_obj)
+            results.append(result)
+        return results
@@ -24,6 +24,9 @@ setup(name='polymorphic_sqlalchemy',
           'SQLAlchemy',
           'inflection'
       ],
+      extras_require={
+          'numpy': ['numpy'],
+      },
       classifiers=[
           "Intended Audience :: Developers",
           "Operating System :: OS Independent",
@@ -2,7 +2,8 @@ import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from polymorphic_sqlalchemy import (create_polymorphic_base, Relation,
-                                    PolyField, NetRelationship, NetModel, BaseInitializer)
+                                    PolyField, NetRelationship, NetModel, BaseInitializer,
+                                    CASCADE_DELETE, CASCADE_SET_NULL, CASCADE_RESTRICT, CollectionCache)
 from sqlalchemy import Column, Integer, String, ForeignKey
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.associationproxy import association_proxy
@@ -26,6 +27,10 @@ class Dealer:
     def find(cls, id):
         return cls(id)
 
+    @classmethod
+    def find_many(cls, ids):
+        return [cls(id) for id in ids]
+
     def __eq__(self, other):
         return self.id == other.id
 
@@ -33,6 +38,21 @@ class Dealer:
         return '< Dealer id: {} >'.format(self.id)
 
 
+class RemoteDealer:
+    """ Network backed model without find_many whose find raises when the dealer does not exist """
+
+    existing_ids = ('1', '2', '3')
+
+    def __init__(self, id):
+        self.id = id
+
+    @classmethod
+    def find(cls, id):
+        if id not in cls.existing_ids:
+            raise KeyError(id)
+        return cls(id)
+
+
 class Vehicle(BaseInitializer, db.Model):
     __tablename__ = "vehicle"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -60,8 +80,9 @@ class Records(BaseInitializer, db.Model):
     buyer_type = Column(String(50), nullable=False)
     seller_id = Column(String(50), nullable=False)
     seller_type = Column(String(50), nullable=False)
-    buyer__dealer = NetRelationship(prefix='buyer', _class=Dealer)
+    buyer__dealer = NetRelationship(prefix='buyer', _class=Dealer, aliases=('car_dealer',))
     seller__dealer = NetRelationship(prefix='seller', _class=Dealer)
+    buyer__remote_dealer = NetRelationship(prefix='buyer', _class=RemoteDealer)
     buyer = PolyField(prefix='buyer')
     seller = PolyField(prefix='seller')
 
@@ -101,8 +122,10 @@ class VehicleReferencePrice(BaseInitializer, db.Model):
     source = PolyField(prefix='source')
 
 
+# SomeRecord used to be called ManheimRecord
 HasVehicleReferencePrices = create_polymorphic_base(data_class=VehicleReferencePrice,
-                                                    data_class_attr='source')
+                                                    data_class_attr='source',
+                                                    type_aliases={'some_record': ('manheim_record',)})
 
 
 class FairEstimatedValue(BaseInitializer, db.Model, HasVehicleReferencePrices):
@@ -201,3 +224,82 @@ class BMWVehicles(BaseInitializer, db.Model):
     source_type = 'dealer'
     source = PolyField(prefix='source')
     source__dealer = NetRelationship(prefix='source', _class=Dealer)
+
+
+# ---------- Cascade policies --------------
+
+
+class Attachment(BaseInitializer, db.Model):
+    __tablename__ = "attachments"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner_id = Column(String(50), nullable=False)
+    owner_type = Column(String(50), nullable=False)
+    owner = PolyField(prefix='owner')
+
+
+class Label(BaseInitializer, db.Model):
+    __tablename__ = "labels"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    target_id = Column(String(50), nullable=True)
+    target_type = Column(String(50), nullable=True)
+    target = PolyField(prefix='target')
+
+
+class Lock(BaseInitializer, db.Model):
+    __tablename__ = "locks"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    holder_id = Column(String(50), nullable=False)
+    holder_type = Column(String(50), nullable=False)
+    holder = PolyField(prefix='holder')
+
+
+HasAttachments = create_polymorphic_base(data_class=Attachment, data_class_attr='owner', cascade=CASCADE_DELETE)
+HasLabels = create_polymorphic_base(data_class=Label, data_class_attr='target', cascade=CASCADE_SET_NULL)
+HasLocks = create_polymorphic_base(data_class=Lock, data_class_attr='holder', cascade=CASCADE_RESTRICT)
+
+
+class Folder(BaseInitializer, db.Model, HasAttachments, HasLabels, HasLocks):
+    __tablename__ = "folders"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+
+class Document(BaseInitializer, db.Model, HasAttachments, HasLabels):
+    __tablename__ = "documents"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+
+class Shelf(BaseInitializer, db.Model):
+    __tablename__ = "shelves"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    boxes = relationship('Box', cascade='all, delete-orphan')
+
+
+class Box(BaseInitializer, db.Model, HasAttachments):
+    __tablename__ = "boxes"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    shelf_id = Column(Integer, ForeignKey('shelves.id'))
+
+
+# ---------- Cached collections --------------
+
+
+class Comment(BaseInitializer, db.Model):
+    __tablename__ = "comments"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    subject_id = Column(String(50), nullable=False)
+    subject_type = Column(String(50), nullable=False)
+    subject = PolyField(prefix='subject')
+
+
+comments_cache = CollectionCache()
+HasComments = create_polymorphic_base(data_class=Comment, data_class_attr='subject', cache=comments_cache)
+
+
+class Post(BaseInitializer, db.Model, HasComments):
+    __tablename__ = "posts"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+
+class Photo(BaseInitializer, db.Model, HasComments):
+    __tablename__ = "photos"
+    id = Column(Integer, primary_key=True, autoincrement=True)
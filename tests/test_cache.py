@@ -0,0 +1,132 @@
+from polymorphic_sqlalchemy import load_collections
+from models import db, Comment, Post, Photo, comments_cache
+
+
+def get_cached(ref_obj):
+    return comments_cache.backend.get('Comment.subject:{}:{}'.format(ref_obj.__class__.__name__.lower(), ref_obj.id))
+
+
+class TestCollectionCache:
+
+    def test_load_collections_from_cache(self, count_queries):
+        db.create_all()
+        post1, post2, photo1 = Post(), Post(), Photo()
+        db.session.add_all([post1, post2, photo1])
+        db.session.flush()
+        comments = [Comment(subject=post1), Comment(subject=post1), Comment(subject=photo1)]
+        db.session.add_all(comments)
+        db.session.flush()
+        db.session.expire_all()
+        ref_objs = [post1, post2, photo1]
+        for ref_obj in ref_objs:
+            ref_obj.id
+
+        with count_queries() as statements:
+            load_collections(ref_objs, 'comments')
+        # One query per ref class
+        assert len(statements) == 2
+        assert post1.comments == comments[:2]
+        assert post2.comments == []
+        assert photo1.comments == comments[2:]
+        assert get_cached(post1) == [comment.id for comment in comments[:2]]
+
+        for ref_obj in ref_objs:
+            db.session.expire(ref_obj, ['comments'])
+        with count_queries() as statements:
+            load_collections(ref_objs, 'comments')
+            assert post1.comments == comments[:2]
+            assert photo1.comments == comments[2:]
+        # Everything comes from the cache and the identity map
+        assert statements == []
+        db.session.rollback()
+        assert get_cached(post1) is None
+
+    def test_invalidation(self):
+        db.create_all()
+        post1, post2, photo1 = Post(), Post(), Photo()
+        db.session.add_all([post1, post2, photo1])
+        db.session.flush()
+        comments = [Comment(subject=post1), Comment(subject=post1), Comment(subject=photo1)]
+        db.session.add_all(comments)
+        db.session.flush()
+        load_collections([post1, post2, photo1], 'comments')
+        assert get_cached(post1) is not None
+
+        # Append
+        post1.comments.append(Comment())
+        assert get_cached(post1) is None
+
+        # Remove
+        photo1.comments.remove(comments[2])
+        assert get_cached(photo1) is None
+        db.session.delete(comments[2])
+
+        # Flush
+        db.session.expire(post2, ['comments'])
+        load_collections([post2], 'comments')
+        assert get_cached(post2) == []
+        comments[0].subject = post2
+        db.session.flush()
+        assert get_cached(post2) is None
+        db.session.rollback()
+
+    def test_invalidated_again_after_commit(self):
+        db.create_all()
+        post1, post2 = Post(), Post()
+        db.session.add_all([post1, post2])
+        db.session.flush()
+        comment = Comment(subject=post1)
+        db.session.add(comment)
+        db.session.flush()
+        comment.subject = post2
+        db.session.flush()
+        # Another session caches the committed collection before this transaction commits
+        comments_cache.backend['Comment.subject:post:{}'.format(post2.id)] = []
+        db.session.commit()
+        assert get_cached(post2) is None
+
+        for obj in (comment, post1, post2):
+            db.session.delete(obj)
+        db.session.commit()
+
+    def test_moving_expired_data_objects(self):
+        db.create_all()
+        post1, post2 = Post(), Post()
+        db.session.add_all([post1, post2])
+        db.session.flush()
+        comment = Comment(subject=post1)
+        db.session.add(comment)
+        db.session.flush()
+        comment_id = comment.id
+        db.session.commit()
+        load_collections([post1, post2], 'comments')
+        db.session.commit()
+        assert get_cached(post1) == [comment_id]
+
+        # The commit expired the comment so its old subject_id is not in the history
+        comment.subject_id = str(post2.id)
+        db.session.commit()
+        assert get_cached(post1) is None
+        load_collections([post1, post2], 'comments')
+        assert post1.comments == []
+        assert post2.comments == [comment]
+
+        for obj in (comment, post1, post2):
+            db.session.delete(obj)
+        db.session.commit()
+
+    def test_cached_data_objects_that_moved_are_dropped(self):
+        db.create_all()
+        post1, post2 = Post(), Post()
+        db.session.add_all([post1, post2])
+        db.session.flush()
+        comment = Comment(subject=post2)
+        db.session.add(comment)
+        db.session.flush()
+
+        # For example cached by another session before the comment was moved
+        comments_cache.backend['Comment.subject:post:{}'.format(post1.id)] = [comment.id]
+        load_collections([post1], 'comments')
+        assert post1.comments == []
+        assert get_cached(post1) == []
+        db.session.rollback()
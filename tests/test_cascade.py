@@ -0,0 +1,110 @@
+import pytest
+from models import db, Attachment, Label, Lock, Folder, Document, Shelf, Box
+
+
+class TestCascade:
+
+    def test_cascade_delete_and_set_null(self, count_queries):
+        db.create_all()
+        folder1, folder2, document1 = Folder(), Folder(), Document()
+        db.session.add_all([folder1, folder2, document1])
+        db.session.flush()
+        db.session.add_all([
+            Attachment(owner=folder1), Attachment(owner=folder1), Attachment(owner=folder2),
+            Attachment(owner=document1), Label(target=folder1), Label(target=document1),
+        ])
+        db.session.flush()
+        folder2_id = folder2.id
+        db.session.expire_all()
+
+        db.session.delete(folder1)
+        db.session.delete(document1)
+        with count_queries() as statements:
+            db.session.flush()
+
+        # One statement per data class and ref type. The data objects are not loaded.
+        assert not any(statement.startswith('SELECT') and 'FROM attachments' in statement for statement in statements)
+        assert not any(statement.startswith('SELECT') and 'FROM labels' in statement for statement in statements)
+        assert len([statement for statement in statements if statement.startswith('DELETE FROM attachments')]) == 2
+        assert len([statement for statement in statements if statement.startswith('UPDATE labels')]) == 2
+
+        attachments = db.session.query(Attachment.owner_type, Attachment.owner_id).all()
+        assert attachments == [('folder', str(folder2_id))]
+        labels = db.session.query(Label.target_type, Label.target_id).all()
+        assert labels == [(None, None), (None, None)]
+        db.session.rollback()
+
+    def test_cascade_restrict(self):
+        db.create_all()
+        folder1 = Folder()
+        db.session.add(folder1)
+        db.session.flush()
+        db.session.add(Lock(holder=folder1))
+        db.session.flush()
+
+        db.session.delete(folder1)
+        with pytest.raises(ValueError):
+            db.session.flush()
+        db.session.rollback()
+
+    def test_loaded_data_objects_are_synchronized(self):
+        db.create_all()
+        folder1, folder2 = Folder(), Folder()
+        db.session.add_all([folder1, folder2])
+        db.session.flush()
+        folder1_attachments = [Attachment(owner=folder1), Attachment(owner=folder1)]
+        folder2_attachment = Attachment(owner=folder2)
+        label = Label(target=folder1)
+        db.session.add_all(folder1_attachments + [folder2_attachment, label])
+        db.session.flush()
+
+        db.session.delete(folder1)
+        db.session.flush()
+
+        assert all(attachment not in db.session for attachment in folder1_attachments)
+        assert folder2_attachment in db.session
+        assert label.target_type is None
+        assert label.target_id is None
+
+        # Modifying the remaining objects does not run into the deleted rows
+        folder2_attachment.owner_id = str(folder2.id)
+        label.target = folder2
+        db.session.flush()
+        db.session.rollback()
+
+    def test_pending_changes_are_flushed_first(self):
+        db.create_all()
+        folder1, folder2 = Folder(), Folder()
+        db.session.add_all([folder1, folder2])
+        db.session.flush()
+        label = Label(target=folder1)
+        db.session.add(label)
+        db.session.flush()
+
+        # The label is moved away from the folder that is deleted in the same flush
+        label.target_id = str(folder2.id)
+        db.session.delete(folder1)
+        db.session.flush()
+
+        labels = db.session.query(Label.target_type, Label.target_id).all()
+        assert labels == [('folder', str(folder2.id))]
+        db.session.rollback()
+
+    def test_ref_objects_deleted_by_other_cascades(self):
+        db.create_all()
+        shelf = Shelf()
+        box1, box2 = Box(), Box()
+        shelf.boxes.extend([box1, box2])
+        db.session.add(shelf)
+        db.session.flush()
+        db.session.add_all([Attachment(owner=box1), Attachment(owner=box2)])
+        db.session.flush()
+
+        # delete-orphan deletes the box during the flush
+        shelf.boxes.remove(box1)
+        db.session.flush()
+
+        assert db.session.query(Box.id).all() == [(box2.id,)]
+        attachments = db.session.query(Attachment.owner_type, Attachment.owner_id).all()
+        assert attachments == [('box', str(box2.id))]
+        db.session.rollback()
@@ -0,0 +1,87 @@
+import pytest
+from array import array
+from polymorphic_sqlalchemy import export_references, export, PolyColumns
+from models import db, Dealer, Org, Records, SomeRecord, FairEstimatedValue, VehicleReferencePrice
+
+
+@pytest.fixture(params=['numpy', 'stdlib'])
+def numpy_or_stdlib(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(export, 'np', None)
+
+
+class TestExportReferences:
+
+    def test_export_records(self, numpy_or_stdlib):
+        db.create_all()
+        org1, org2 = Org(), Org()
+        db.session.add_all([org1, org2])
+        db.session.flush()
+        db.session.add_all([
+            Records(buyer=org1, seller=Dealer(1)),
+            Records(buyer=org1, seller=Dealer(1)),
+            Records(buyer=org2, seller=Dealer(2)),
+            Records(buyer=Dealer(5), seller=org1),
+        ])
+        db.session.flush()
+
+        columns = export_references(db.session, Records, prefixes=('buyer', 'seller'), chunk_size=3)
+        buyer, seller = columns['buyer'], columns['seller']
+        assert len(buyer) == 4
+        assert buyer.type_names == ['company', 'dealer', 'org', 'remote_dealer']
+        # buyer_id is a String column so the ids are dictionary encoded
+        assert isinstance(buyer.ids, array)
+        assert sorted(buyer.id_values) == sorted([str(org1.id), str(org2.id), '5'])
+        assert sorted(buyer.get_ids()) == sorted([str(org1.id), str(org1.id), str(org2.id), '5'])
+
+        assert buyer.count_by_type() == {'org': 3, 'dealer': 1}
+        assert seller.count_by_type() == {'dealer': 3, 'org': 1}
+        assert sorted(buyer.group_by_type()['org']) == sorted([str(org1.id), str(org1.id), str(org2.id)])
+
+        fan_out = seller.fan_out()['dealer']
+        assert (fan_out.rows, fan_out.refs, fan_out.max, fan_out.mean) == (3, 2, 2, 1.5)
+        db.session.rollback()
+
+    def test_aliases_share_codes(self, numpy_or_stdlib):
+        db.create_all()
+        fev1, some1 = FairEstimatedValue(), SomeRecord()
+        db.session.add_all([fev1, some1])
+        db.session.flush()
+        db.session.add_all([
+            VehicleReferencePrice(source=fev1),
+            VehicleReferencePrice(source=some1),
+            VehicleReferencePrice(source_type='manheim_record', source_id=str(some1.id)),
+        ])
+        db.session.flush()
+
+        source = export_references(db.session, VehicleReferencePrice, prefixes=('source',))['source']
+        assert source.count_by_type() == {'fair_estimated_value': 1, 'some_record': 2}
+        assert source.fan_out()['some_record'].refs == 1
+        db.session.rollback()
+
+    def test_string_ids_are_not_converted(self, numpy_or_stdlib):
+        db.create_all()
+        db.session.add_all([
+            Records(buyer_type='dealer', buyer_id='01', seller=Dealer(1)),
+            Records(buyer_type='dealer', buyer_id='1', seller=Dealer(1)),
+        ])
+        db.session.flush()
+
+        buyer = export_references(db.session, Records, prefixes=('buyer',))['buyer']
+        assert not buyer.numeric_ids
+        assert sorted(buyer.id_values) == ['01', '1']
+        assert sorted(buyer.get_ids()) == ['01', '1']
+        assert buyer.fan_out()['dealer'].refs == 2
+        db.session.rollback()
+
+    def test_numeric_ids(self, numpy_or_stdlib):
+        columns = PolyColumns('buyer', type_names=('dealer', 'org'))
+        columns.extend([('org', 1), ('dealer', 2), ('org', 1), (None, 3)])
+        assert isinstance(columns.ids, array)
+        assert columns.ids.tolist() == [1, 2, 1]
+        assert columns.get_ids() == [1, 2, 1]
+        assert sorted(columns.group_by_type()['org']) == [1, 1]
+        assert columns.nulls == 1
+        assert columns.fan_out()['org'].refs == 1
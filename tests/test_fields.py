@@ -1,4 +1,4 @@
-from polymorphic_sqlalchemy import NetRelationship, PolyField, NetModel
+from polymorphic_sqlalchemy import NetRelationship, PolyField, NetModel, ext
 from models import Dealer
 
 
@@ -34,6 +34,10 @@ class TestNetRelationship:
         del obj._seller__dealer
         assert obj.seller__dealer.id == 1
 
+    def test_class_access_returns_descriptor(self):
+        assert isinstance(NetworkModel1.seller__dealer, NetRelationship)
+        assert isinstance(NetworkModel2.dealer, NetModel)
+
 
 
 class PolyModel:
@@ -45,6 +49,12 @@ class PolyModel:
     buyer = PolyField(prefix='buyer')
 
 
+class AliasModel:
+
+    buyer = PolyField(prefix='buyer')
+    buyer__dealer = NetRelationship(prefix='buyer', _class=Dealer, aliases=('car_dealer',))
+
+
 class TestPolyField:
 
     def test_poly_field_set_and_get(self):
@@ -66,6 +76,18 @@ class TestPolyField:
         obj.buyer = dealer2
         assert obj.buyer__dealer is dealer2
 
+    def test_poly_field_alias(self, monkeypatch):
+        obj = AliasModel()
+        obj.buyer_type = 'car_dealer'
+        obj.buyer_id = 1
+        assert obj.buyer == Dealer(1)
+
+        # The attribute is resolved once per type
+        monkeypatch.setattr(ext, 'resolve_type_alias', None)
+        assert obj.buyer == Dealer(1)
+        obj.buyer_type = 'dealer'
+        assert obj.buyer == Dealer(1)
+
 
 class NetworkModel2:
 
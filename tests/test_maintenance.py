@@ -0,0 +1,157 @@
+import pytest
+from polymorphic_sqlalchemy import OrphanScanner, migrate_type
+from models import db, Dealer, Org, Records, SomeRecord, VehicleReferencePrice
+
+
+class TestOrphanScanner:
+
+    def test_scan_in_chunks_and_resume(self):
+        db.create_all()
+        org1 = Org()
+        db.session.add(org1)
+        db.session.flush()
+        records = {
+            'org': Records(buyer=org1, seller=Dealer(1)),
+            'missing_org': Records(buyer_type='org', buyer_id='999', seller=Dealer(2)),
+            'dealer': Records(buyer=Dealer(3), seller=org1),
+            'unknown_type': Records(buyer_type='deleted_model', buyer_id='1', seller=org1),
+            'bad_id': Records(buyer_type='org', buyer_id='not a number', seller=org1),
+            'remote_dealer': Records(buyer_type='remote_dealer', buyer_id='2', seller=org1),
+            'missing_remote_dealer': Records(buyer_type='remote_dealer', buyer_id='404', seller=org1),
+        }
+        db.session.add_all(records.values())
+        db.session.flush()
+        ids = {name: rec.id for name, rec in records.items()}
+        expected_orphans = sorted(ids[name] for name in ('missing_org', 'bad_id', 'missing_remote_dealer'))
+        scanner = OrphanScanner(db.session, data_class=Records, prefix='buyer', chunk_size=2)
+
+        first = next(scanner.scan())
+        assert first.scanned == 2
+        assert first.last_key == sorted(ids.values())[1]
+
+        # Resuming from the checkpoint
+        rest = list(scanner.scan(start_after=first.last_key))
+        assert [result.scanned for result in rest] == [2, 2, 1]
+
+        results = [first] + rest
+        orphans = [orphan for result in results for orphan in result.orphans]
+        assert [orphan.key for orphan in orphans] == expected_orphans
+        unknown = [orphan for result in results for orphan in result.unknown]
+        assert [(orphan.key, orphan.type) for orphan in unknown] == [(ids['unknown_type'], 'deleted_model')]
+        orphan = next(orphan for orphan in orphans if orphan.key == ids['missing_org'])
+        assert (orphan.type, orphan.id) == ('org', '999')
+        db.session.rollback()
+
+    def test_scan_and_delete(self):
+        db.create_all()
+        org1 = Org()
+        db.session.add(org1)
+        db.session.flush()
+        records = {
+            'org': Records(buyer=org1, seller=Dealer(1)),
+            'missing_org': Records(buyer_type='org', buyer_id='999', seller=Dealer(2)),
+            'unknown_type': Records(buyer_type='deleted_model', buyer_id='1', seller=org1),
+            'remote_dealer': Records(buyer_type='remote_dealer', buyer_id='2', seller=org1),
+            'missing_remote_dealer': Records(buyer_type='remote_dealer', buyer_id='404', seller=org1),
+        }
+        db.session.add_all(records.values())
+        db.session.flush()
+        ids = {name: rec.id for name, rec in records.items()}
+        scanner = OrphanScanner(db.session, data_class=Records, prefix='buyer', chunk_size=10)
+
+        # Unknown types are not deleted unless asked for
+        results = list(scanner.scan(delete=True))
+        assert sum(result.deleted for result in results) == 2
+        remaining = [row[0] for row in db.session.query(Records.id).order_by(Records.id)]
+        assert remaining == sorted([ids['org'], ids['unknown_type'], ids['remote_dealer']])
+
+        results = list(scanner.scan(delete=True, delete_unknown=True))
+        assert sum(result.deleted for result in results) == 1
+        remaining = [row[0] for row in db.session.query(Records.id).order_by(Records.id)]
+        assert remaining == sorted([ids['org'], ids['remote_dealer']])
+
+        seller_scanner = OrphanScanner(db.session, data_class=Records, prefix='seller')
+        assert [result.orphans for result in seller_scanner.scan()] == [[]]
+        db.session.rollback()
+
+    def test_alias_and_type_name_share_one_query(self, count_queries):
+        db.create_all()
+        some1 = SomeRecord()
+        db.session.add(some1)
+        db.session.flush()
+        db.session.add_all([
+            VehicleReferencePrice(source_type='manheim_record', source_id=str(some1.id)),
+            VehicleReferencePrice(source=some1),
+            VehicleReferencePrice(source_type='some_record', source_id='999'),
+        ])
+        db.session.flush()
+        scanner = OrphanScanner(db.session, data_class=VehicleReferencePrice, prefix='source')
+
+        with count_queries() as statements:
+            orphans = [orphan for result in scanner.scan() for orphan in result.orphans]
+        assert len([statement for statement in statements if 'FROM some_record' in statement]) == 1
+        assert [(orphan.type, orphan.id) for orphan in orphans] == [('some_record', '999')]
+        db.session.rollback()
+
+    def test_net_ids_are_compared_as_strings(self, monkeypatch):
+        db.create_all()
+        org1 = Org()
+        db.session.add(org1)
+        db.session.flush()
+        db.session.add_all([Records(buyer=Dealer(1), seller=org1), Records(buyer=Dealer(2), seller=org1)])
+        db.session.flush()
+        scanner = OrphanScanner(db.session, data_class=Records, prefix='buyer')
+
+        # The network model returns integer ids for the stored '1' and '2'
+        monkeypatch.setattr(Dealer, 'find_many', classmethod(lambda cls, ids: [cls(int(id_)) for id_ in ids]))
+        results = list(scanner.scan(delete=True))
+        assert [result.orphans for result in results] == [[]]
+
+        # Nothing is deleted when none of the returned objects match
+        monkeypatch.setattr(Dealer, 'find_many', classmethod(lambda cls, ids: [cls('other')]))
+        with pytest.raises(ValueError):
+            list(scanner.scan(delete=True))
+        assert db.session.query(Records).count() == 2
+        db.session.rollback()
+
+
+class TestMigrateType:
+
+    def test_aliases_resolve_during_migration(self):
+        db.create_all()
+        some1 = SomeRecord()
+        db.session.add(some1)
+        db.session.flush()
+        prices = [VehicleReferencePrice(source_type='manheim_record', source_id=str(some1.id)) for _ in range(3)]
+        new_price = VehicleReferencePrice(source=some1)
+        db.session.add_all(prices + [new_price])
+        db.session.flush()
+        db.session.expire_all()
+
+        assert prices[0].source == some1
+        assert set(some1.vehicle_reference_prices) == set(prices + [new_price])
+
+        results = list(migrate_type(db.session, VehicleReferencePrice, 'source', 'manheim_record', 'some_record',
+                                    batch_size=2, commit=False))
+        assert [result.updated for result in results] == [2, 1]
+        assert results[-1].last_key == prices[-1].id
+
+        db.session.expire_all()
+        assert [price.source_type for price in prices] == ['some_record'] * 3
+        assert set(some1.vehicle_reference_prices) == set(prices + [new_price])
+        db.session.rollback()
+
+    def test_net_relationship_alias(self):
+        record = Records(buyer_type='car_dealer', buyer_id=1)
+        assert record.buyer == Dealer(1)
+
+        db.create_all()
+        org1 = Org()
+        db.session.add(org1)
+        db.session.flush()
+        record.seller = org1
+        db.session.add(record)
+        db.session.flush()
+        scanner = OrphanScanner(db.session, data_class=Records, prefix='buyer')
+        assert [result.orphans for result in scanner.scan()] == [[]]
+        db.session.rollback()
@@ -74,6 +74,30 @@ class TestPolymorphicGenerator:
         db.session.flush()  # Making sure that DB does not complain.
         db.session.rollback()
 
+    def test_append_to_generated_collections(self):
+        db.create_all()
+
+        org1 = Org()
+        db.session.add(org1)
+        db.session.flush()
+
+        dealer1 = Dealer(1)
+        rec1 = Records(seller=dealer1)
+        rec2 = Records(buyer=dealer1)
+        org1.buyer_records.append(rec1)
+        org1.seller_records.append(rec2)
+
+        assert rec1.buyer_type == 'org'
+        assert rec1.buyer_id == org1.id
+        assert rec1.seller_type == 'dealer'
+        assert rec2.seller_type == 'org'
+        assert rec2.seller_id == org1.id
+        assert rec2.buyer_type == 'dealer'
+        assert org1.buyer_records == [rec1]
+        assert org1.seller_records == [rec2]
+        db.session.flush()
+        db.session.rollback()
+
     def test_polymorphic_generator_one_relationship(self):
         db.create_all()
 
@@ -0,0 +1,105 @@
+from polymorphic_sqlalchemy import Serializer, prefetch, NetRelationship, PolyField
+from models import db, Dealer, Org, Records
+
+
+class Item:
+    """ Network backed model that counts the calls to find """
+
+    find_calls = []
+
+    def __init__(self, id):
+        self.id = id
+
+    @classmethod
+    def find(cls, id):
+        cls.find_calls.append(id)
+        return cls(id)
+
+    @classmethod
+    def find_many(cls, ids):
+        return [cls(id) for id in ids]
+
+
+class Ticket:
+
+    def __init__(self, item_id):
+        self.item_type = 'item'
+        self.item_id = item_id
+
+    item = PolyField(prefix='item')
+    item__item = NetRelationship(prefix='item', _class=Item)
+
+
+class TestPrefetch:
+
+    def test_prefetch_keeps_id_types(self):
+        Item.find_calls.clear()
+        tickets = [Ticket(7), Ticket(7), Ticket(8)]
+        prefetch(tickets, prefixes=('item',))
+
+        assert [ticket.item.id for ticket in tickets] == [7, 7, 8]
+        assert tickets[0].item is tickets[1].item
+        assert Item.find_calls == []
+
+    def test_prefetch_batches_queries(self, count_queries):
+        db.create_all()
+        org1, org2 = Org(), Org()
+        db.session.add_all([org1, org2])
+        db.session.flush()
+        records = [
+            Records(buyer=org1, seller=Dealer(1)),
+            Records(buyer=org2, seller=org1),
+            Records(buyer=Dealer(2), seller=org2),
+        ]
+        db.session.add_all(records)
+        db.session.flush()
+        ids, org1_id, org2_id = [rec.id for rec in records], org1.id, org2.id
+        db.session.expire_all()
+        records = db.session.query(Records).filter(Records.id.in_(ids)).order_by(Records.id).all()
+
+        with count_queries() as statements:
+            prefetch(records, prefixes=('buyer', 'seller'))
+        # One IN query per ref class per prefix
+        assert len(statements) == 2
+
+        with count_queries() as statements:
+            assert records[0].buyer.id == org1_id
+            assert records[0].seller.id == '1'
+            assert records[1].buyer.id == org2_id
+            assert records[1].seller.id == org1_id
+            assert records[2].buyer.id == '2'
+            assert records[2].seller.id == org2_id
+        assert statements == []
+        db.session.rollback()
+
+
+class TestSerializer:
+
+    def test_serialize(self):
+        db.create_all()
+        org1, org2 = Org(), Org()
+        db.session.add_all([org1, org2])
+        db.session.flush()
+        records = [
+            Records(buyer=org1, seller=Dealer(1)),
+            Records(buyer=org2, seller=org1),
+            Records(buyer=Dealer(2), seller=org2),
+        ]
+        db.session.add_all(records)
+        db.session.flush()
+        ids, org1_id, org2_id = [rec.id for rec in records], org1.id, org2.id
+        db.session.expire_all()
+        records = db.session.query(Records).filter(Records.id.in_(ids)).order_by(Records.id).all()
+
+        serializer = Serializer(prefixes=('buyer', 'seller'), fields={Records: ('id', 'buyer_type', 'seller_type')})
+        result = serializer.serialize(records)
+
+        assert result == [
+            {'id': ids[0], 'buyer_type': 'org', 'seller_type': 'dealer',
+             'buyer': {'id': org1_id}, 'seller': {'id': '1'}},
+            {'id': ids[1], 'buyer_type': 'org', 'seller_type': 'org',
+             'buyer': {'id': org2_id}, 'seller': {'id': org1_id}},
+            {'id': ids[2], 'buyer_type': 'dealer', 'seller_type': 'org',
+             'buyer': {'id': '2'}, 'seller': {'id': org2_id}},
+        ]
+        db.session.rollback()